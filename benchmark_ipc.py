@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+控制通道吞吐量测试
+默认在本进程内启动控制通道，填充请求进入与配置相同长度的队列，由后台线程按
+--fill-interval 模拟的粘贴耗时取出，不执行真实粘贴。结果只反映控制通道的传输开销，
+队列满时被拒绝的请求单独统计。
+使用 --address 可以测试正在运行的工具（建议配合 --op status，fill 会真实粘贴）。
+
+    python benchmark_ipc.py --clients 50 --requests 2000 --depth 32
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+
+from fill_ipc import ControlClient, ControlServer, FillQueue, QUEUE_FULL_ERROR
+
+CONFIG_FILE = "smart_config.json"
+
+
+class QueueOnlyEngine:
+    """使用真实 FillQueue 的 engine，由后台线程按固定间隔取出请求丢弃，不执行粘贴"""
+
+    def __init__(self, queue_size: int = 1000, fill_interval: float = 0.0):
+        self.fill_queue = FillQueue(queue_size)
+        self.fill_interval = fill_interval
+        self.is_enabled = True
+        threading.Thread(target=self.drain, daemon=True).start()
+
+    def drain(self):
+        while True:
+            self.fill_queue.get(timeout=None)
+            if self.fill_interval:
+                time.sleep(self.fill_interval)
+            self.fill_queue.count("filled")
+
+    def ipc_fill(self, text, target=None):
+        return self.fill_queue.submit(text, target, self.is_enabled, 20000)
+
+    def ipc_status(self):
+        return {"enabled": self.is_enabled, "queue_depth": self.fill_queue.qsize(),
+                "metrics": self.fill_queue.snapshot()}
+
+    def ipc_toggle(self, enabled=None):
+        self.is_enabled = not self.is_enabled if enabled is None else enabled
+        return {"enabled": self.is_enabled}
+
+    def ipc_reload(self):
+        return {"scheduled": True}
+
+
+def configured_queue_size() -> int:
+    """读取配置文件中的填充队列长度"""
+    try:
+        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get("ipc", {}).get("queue_size", 1000)
+    except (OSError, ValueError):
+        return 1000
+
+
+def run_client(address, token_file, op, count, depth, latencies, errors, rejected, barrier):
+    """单个客户端: 每批发送 depth 条请求，再读取全部响应"""
+    client = ControlClient(address, token_file=token_file, timeout=30)
+    request = {"op": op}
+    if op == "fill":
+        request.update(text="吞吐量测试", target="benchmark")
+
+    barrier.wait()
+    remaining = count
+    try:
+        while remaining:
+            batch = min(depth, remaining)
+            started = time.perf_counter()
+            client.send_many([request] * batch)
+            for _ in range(batch):
+                response = client.receive()
+                if response.get("ok"):
+                    continue
+                if response.get("error") == QUEUE_FULL_ERROR:
+                    rejected.append(1)
+                else:
+                    errors.append(1)
+            latencies.append((time.perf_counter() - started) / batch)
+            remaining -= batch
+    finally:
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="控制通道吞吐量测试")
+    parser.add_argument("--address", help="连接已运行的工具，不指定时在本进程内启动控制通道")
+    parser.add_argument("--token-file", help="令牌文件，连接已运行的工具时使用，默认读取用户目录下的令牌文件")
+    parser.add_argument("--tcp", action="store_true", help="本进程内的控制通道使用回环 TCP")
+    parser.add_argument("--op", default="fill", choices=["ping", "fill", "status"], help="请求类型")
+    parser.add_argument("--clients", type=int, default=50, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=2000, help="每个客户端的请求数")
+    parser.add_argument("--depth", type=int, default=32, help="流水线深度")
+    parser.add_argument("--queue-size", type=int, default=configured_queue_size(),
+                        help="本进程内填充队列长度，默认读取配置中的 ipc.queue_size")
+    parser.add_argument("--fill-interval", type=float, default=0.15,
+                        help="本进程内模拟每次粘贴的耗时（秒）")
+    args = parser.parse_args()
+
+    server = None
+    workdir = None
+    address = args.address
+    token_file = args.token_file
+    if not address:
+        workdir = tempfile.TemporaryDirectory()
+        token_file = os.path.join(workdir.name, "benchmark.token")
+        if args.tcp or not hasattr(socket, "AF_UNIX"):
+            address = "127.0.0.1:0"
+        else:
+            address = os.path.join(workdir.name, "benchmark.sock")
+        server = ControlServer(QueueOnlyEngine(args.queue_size, args.fill_interval), address, token_file=token_file)
+        server.start()
+        address = server.address
+
+    latencies = []
+    errors = []
+    rejected = []
+    barrier = threading.Barrier(args.clients + 1)
+    threads = [
+        threading.Thread(
+            target=run_client,
+            args=(address, token_file, args.op, args.requests, args.depth, latencies, errors, rejected, barrier),
+            daemon=True
+        )
+        for _ in range(args.clients)
+    ]
+    for thread in threads:
+        thread.start()
+
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    total = args.clients * args.requests
+    accepted = total - len(rejected) - len(errors)
+    print(f"地址: {address}")
+    print(f"客户端: {args.clients}  每客户端请求: {args.requests}  流水线深度: {args.depth}  操作: {args.op}")
+    print(f"总请求: {total}  成功: {accepted}  队列满被拒绝: {len(rejected)}  其他失败: {len(errors)}  耗时: {elapsed:.3f}s")
+    print(f"响应吞吐量（含错误响应）: {total / elapsed:,.0f} 请求/秒")
+    print(f"成功请求吞吐量: {accepted / elapsed:,.0f} 请求/秒")
+    if latencies:
+        ordered = sorted(latencies)
+        print(f"每批平均单请求耗时: {statistics.mean(ordered) * 1e6:.1f}us  "
+              f"p99: {ordered[int(len(ordered) * 0.99) - 1] * 1e6:.1f}us")
+
+    if server:
+        fill_queue = server.engine.fill_queue
+        print(f"已处理填充: {fill_queue.snapshot()['filled']}  队列剩余: {fill_queue.qsize()}"
+              f"  (队列长度 {args.queue_size}，模拟粘贴耗时 {args.fill_interval}s)")
+        server.stop()
+        workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
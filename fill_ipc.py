@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地控制通道
+供自动化脚本提交填充请求、查询状态、切换启用和重新加载配置。
+
+协议: 每行一个 JSON 对象（UTF-8，以 \\n 结尾），同一连接上可以连续发送多条请求，
+响应按请求顺序逐行返回。连接后的第一条请求必须是认证请求，令牌在服务启动时生成，
+写入只有当前用户可读的令牌文件。认证失败或收到不是 JSON 对象的行时立即断开连接。
+    认证: {"id": 0, "op": "auth", "token": "令牌文件中的内容"}
+    请求: {"id": 1, "op": "fill", "text": "内容", "target": "chrome"}
+    响应: {"id": 1, "ok": true, "result": {...}}
+          {"id": 1, "ok": false, "error": "错误信息"}
+
+支持的 op: ping / fill / status / toggle / reload
+
+所有连接由一个线程通过 selectors 多路复用处理，不为每个客户端创建线程。
+"""
+
+import hmac
+import json
+import logging
+import os
+import queue
+import secrets
+import selectors
+import socket
+import stat
+import threading
+from typing import Optional, Tuple
+
+# 系统不支持 Unix 域套接字时（如 Windows 上的 Python）使用本机回环地址
+DEFAULT_UNIX_ADDRESS = "smart_auto_fill.sock"
+DEFAULT_TCP_ADDRESS = "127.0.0.1:47321"
+
+# 令牌文件放在用户目录下，Windows 上用户目录默认只有本人可以访问
+DEFAULT_TOKEN_FILE = os.path.join(os.path.expanduser("~"), ".smart_auto_fill_token")
+
+# 单条请求的最大字节数，超过后断开连接
+MAX_REQUEST_SIZE = 1024 * 1024
+
+OPERATIONS = ("ping", "fill", "status", "toggle", "reload")
+
+# 填充队列已满时返回的错误信息
+QUEUE_FULL_ERROR = "填充队列已满"
+
+
+class ControlError(Exception):
+    """请求无法处理时抛出，错误信息会原样返回给客户端"""
+
+
+def default_address() -> str:
+    """返回当前系统的默认控制地址"""
+    if hasattr(socket, "AF_UNIX"):
+        return DEFAULT_UNIX_ADDRESS
+    return DEFAULT_TCP_ADDRESS
+
+
+def parse_address(address: Optional[str]) -> Tuple[int, object]:
+    """解析控制地址，"host:port" 为 TCP，其余视为 Unix 域套接字路径"""
+    address = address or default_address()
+    host, sep, port = address.rpartition(":")
+    if sep and host and port.isdigit():
+        return socket.AF_INET, (host, int(port))
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError(f"当前系统不支持 Unix 域套接字: {address}")
+    return socket.AF_UNIX, address
+
+
+def write_token(path: str, token: str):
+    """写入令牌文件，仅当前用户可读写"""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        pass
+    else:
+        if not stat.S_ISREG(st.st_mode):
+            raise FileExistsError(f"令牌文件路径已被占用: {path}")
+        os.unlink(path)
+
+    # O_EXCL 保证新建文件，不会跟随他人预先放置的符号链接
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token)
+
+
+def read_token(path: Optional[str] = None) -> str:
+    """读取令牌文件"""
+    with open(path or DEFAULT_TOKEN_FILE, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def encode_message(message: dict) -> bytes:
+    """编码一条消息"""
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+class FillQueue:
+    """填充请求队列和统计
+
+    控制通道线程通过 submit 提交请求，填充线程通过 get 取出执行，不依赖界面和 win32。
+    """
+
+    METRICS = ("submitted", "filled", "skipped", "failed", "rejected")
+
+    def __init__(self, maxsize: int = 1000):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.metrics = dict.fromkeys(self.METRICS, 0)
+
+    @property
+    def maxsize(self) -> int:
+        """队列长度上限"""
+        return self._queue.maxsize
+
+    def resize(self, maxsize: int):
+        """修改队列长度上限，已在队列中的请求不受影响"""
+        with self._queue.mutex:
+            self._queue.maxsize = maxsize
+
+    def qsize(self) -> int:
+        """当前排队的请求数"""
+        return self._queue.qsize()
+
+    def count(self, name: str):
+        """计数器加一"""
+        with self._lock:
+            self.metrics[name] += 1
+
+    def snapshot(self) -> dict:
+        """返回统计数据的副本"""
+        with self._lock:
+            return dict(self.metrics)
+
+    def submit(self, text: str, target: Optional[str], enabled: bool, max_length: int) -> dict:
+        """提交填充请求，不能接受时抛出 ControlError"""
+        if not enabled:
+            self.count("rejected")
+            raise ControlError("智能填充已禁用")
+
+        content = text.strip()[:max_length]
+        if not content:
+            self.count("rejected")
+            raise ControlError("填充内容为空")
+
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+
+        try:
+            self._queue.put_nowait((seq, content, target))
+        except queue.Full:
+            self.count("rejected")
+            raise ControlError(QUEUE_FULL_ERROR)
+
+        self.count("submitted")
+        return {"seq": seq, "queue_depth": self._queue.qsize()}
+
+    def get(self, timeout: float) -> tuple:
+        """取出一条请求 (seq, content, target)，超时抛出 queue.Empty"""
+        return self._queue.get(timeout=timeout)
+
+    def clear(self):
+        """丢弃所有排队的请求"""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+
+class _Connection:
+    """单个客户端连接的读写缓冲"""
+
+    __slots__ = ("sock", "inbuf", "outbuf", "authenticated", "closing")
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.authenticated = False
+        self.closing = False
+
+
+class ControlServer:
+    """本地控制服务
+
+    engine 需要提供以下方法，均在服务线程中调用，应尽快返回且不能操作界面:
+        ipc_fill(text, target) -> dict
+        ipc_status() -> dict
+        ipc_toggle(enabled) -> dict
+        ipc_reload() -> dict
+    """
+
+    def __init__(self, engine, address: Optional[str] = None, token_file: Optional[str] = None,
+                 max_request_size: int = MAX_REQUEST_SIZE):
+        self.engine = engine
+        self.family, self.sockaddr = parse_address(address)
+        self.token_file = token_file or DEFAULT_TOKEN_FILE
+        self.token = None
+        self.max_request_size = max_request_size
+        self._socket_id = None
+
+        self.clients = 0
+        self.requests = 0
+        self.errors = 0
+
+        self._selector = None
+        self._listener = None
+        self._thread = None
+        self._stopping = False
+
+    @property
+    def address(self) -> str:
+        """实际监听的地址"""
+        if self.family == socket.AF_INET:
+            host, port = self._listener.getsockname() if self._listener else self.sockaddr
+            return f"{host}:{port}"
+        return self.sockaddr
+
+    def start(self):
+        """开始监听"""
+        if self._thread and self._thread.is_alive():
+            if self._stopping:
+                raise RuntimeError("控制通道仍在停止中")
+            return
+
+        if self.family != socket.AF_INET:
+            self._remove_stale_socket()
+
+        listener = socket.socket(self.family, socket.SOCK_STREAM)
+        try:
+            if self.family == socket.AF_INET:
+                # Windows 上 SO_REUSEADDR 允许抢占他人正在监听的端口，改用独占绑定
+                if os.name == "nt":
+                    listener.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+                else:
+                    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(self.sockaddr)
+            if self.family != socket.AF_INET:
+                os.chmod(self.sockaddr, 0o600)
+                st = os.lstat(self.sockaddr)
+                self._socket_id = (st.st_dev, st.st_ino)
+            listener.listen(128)
+            listener.setblocking(False)
+
+            # 监听成功后再生成令牌，避免覆盖正在运行的实例的令牌
+            self.token = secrets.token_hex(16)
+            write_token(self.token_file, self.token)
+        except Exception:
+            listener.close()
+            raise
+
+        self._listener = listener
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(listener, selectors.EVENT_READ)
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._serve,
+            args=(self._selector, self.token, self._socket_id),
+            name="fill-ipc",
+            daemon=True
+        )
+        self._thread.start()
+        logging.info(f"控制通道已启动: {self.address}")
+
+    def stop(self, timeout: float = 2.0):
+        """停止监听并断开所有客户端
+
+        资源由服务线程退出时释放；超时后服务线程仍在处理请求时不等待，
+        线程处理完当前请求后自行关闭。
+        """
+        if not self._thread:
+            return
+
+        self._stopping = True
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            logging.warning("控制通道线程未在超时内退出，将在处理完当前请求后关闭")
+            return
+        self._thread = None
+
+    def _teardown(self, selector, token: Optional[str], socket_id: Optional[tuple]):
+        """关闭所有连接并清理令牌文件和套接字文件，由服务线程退出时调用"""
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+        if self._selector is selector:
+            self._selector = None
+            self._listener = None
+            self.clients = 0
+
+        try:
+            if read_token(self.token_file) == token:
+                os.unlink(self.token_file)
+        except OSError:
+            pass
+        if self.token == token:
+            self.token = None
+
+        # 只删除本实例创建的套接字文件
+        if socket_id:
+            try:
+                st = os.lstat(self.sockaddr)
+                if stat.S_ISSOCK(st.st_mode) and (st.st_dev, st.st_ino) == socket_id:
+                    os.unlink(self.sockaddr)
+            except OSError:
+                pass
+            if self._socket_id == socket_id:
+                self._socket_id = None
+        logging.info("控制通道已停止")
+
+    def _remove_stale_socket(self):
+        """清理上次异常退出遗留的套接字文件，地址被其他文件或正在运行的实例占用时报错"""
+        try:
+            st = os.lstat(self.sockaddr)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(st.st_mode):
+            raise FileExistsError(f"控制地址已被占用且不是套接字文件: {self.sockaddr}")
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.sockaddr)
+        except (ConnectionRefusedError, FileNotFoundError):
+            pass
+        else:
+            raise FileExistsError(f"已有实例在监听控制地址: {self.sockaddr}")
+        finally:
+            probe.close()
+        os.unlink(self.sockaddr)
+
+    def _serve(self, selector, token: str, socket_id: Optional[tuple]):
+        """服务线程主循环"""
+        try:
+            while not self._stopping:
+                try:
+                    events = selector.select(timeout=0.2)
+                except OSError as e:
+                    logging.error(f"控制通道错误: {e}")
+                    break
+
+                for key, mask in events:
+                    if key.data is None:
+                        self._accept()
+                        continue
+                    if mask & selectors.EVENT_READ:
+                        self._read(key.data)
+                    if mask & selectors.EVENT_WRITE and key.data.sock.fileno() != -1:
+                        self._flush(key.data)
+        finally:
+            self._teardown(selector, token, socket_id)
+
+    def _accept(self):
+        """接受新连接"""
+        try:
+            sock, _ = self._listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        if self.family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._selector.register(sock, selectors.EVENT_READ, _Connection(sock))
+        self.clients += 1
+
+    def _close(self, conn: _Connection):
+        """关闭连接"""
+        if conn.sock.fileno() == -1:
+            return
+        try:
+            self._selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+        self.clients -= 1
+        conn.sock.close()
+
+    def _read(self, conn: _Connection):
+        """读取请求并处理缓冲区中所有完整的行"""
+        try:
+            data = conn.sock.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self._close(conn)
+            return
+        if not data:
+            self._close(conn)
+            return
+
+        conn.inbuf += data
+        start = 0
+        while True:
+            end = conn.inbuf.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(conn.inbuf[start:end]).strip()
+            start = end + 1
+            if line:
+                conn.outbuf += encode_message(self.handle_line(conn, line))
+                if conn.closing:
+                    self._flush(conn)
+                    self._close(conn)
+                    return
+        del conn.inbuf[:start]
+
+        if len(conn.inbuf) > self.max_request_size:
+            conn.outbuf += encode_message({"id": None, "ok": False, "error": "请求过长"})
+            self._flush(conn)
+            self._close(conn)
+            return
+
+        if conn.outbuf:
+            self._flush(conn)
+
+    def _flush(self, conn: _Connection):
+        """发送待发送的响应，未发完时等待可写事件"""
+        try:
+            sent = conn.sock.send(conn.outbuf)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close(conn)
+            return
+        del conn.outbuf[:sent]
+
+        if len(conn.outbuf) > self.max_request_size:
+            # 客户端不读取响应时暂停接收新请求
+            events = selectors.EVENT_WRITE
+        elif conn.outbuf:
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE
+        else:
+            events = selectors.EVENT_READ
+        if self._selector.get_key(conn.sock).events != events:
+            self._selector.modify(conn.sock, events, conn)
+
+    def handle_line(self, conn: _Connection, line: bytes) -> dict:
+        """处理一行请求，返回响应；需要断开连接时设置 conn.closing"""
+        self.requests += 1
+        request_id = None
+        try:
+            # 不是 JSON 对象的行直接断开，防止网页通过 HTTP 请求体夹带命令
+            try:
+                request = json.loads(line.decode("utf-8"))
+            except (UnicodeDecodeError, ValueError):
+                conn.closing = True
+                raise ControlError("请求不是合法的 JSON")
+            if not isinstance(request, dict):
+                conn.closing = True
+                raise ControlError("请求必须是 JSON 对象")
+
+            request_id = request.get("id")
+            if not conn.authenticated:
+                self.authenticate(conn, request)
+                return {"id": request_id, "ok": True, "result": {}}
+            return {"id": request_id, "ok": True, "result": self.dispatch(request)}
+        except ControlError as e:
+            self.errors += 1
+            return {"id": request_id, "ok": False, "error": str(e)}
+        except Exception as e:
+            self.errors += 1
+            logging.error(f"处理控制请求失败: {e}")
+            return {"id": request_id, "ok": False, "error": "内部错误"}
+
+    def authenticate(self, conn: _Connection, request: dict):
+        """校验连接的第一条请求，失败时断开连接"""
+        token = request.get("token")
+        if (request.get("op") != "auth" or not isinstance(token, str)
+                or not hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))):
+            conn.closing = True
+            raise ControlError("认证失败")
+        conn.authenticated = True
+
+    def dispatch(self, request: dict) -> dict:
+        """按 op 调用 engine"""
+        op = request.get("op")
+        if op == "ping":
+            return {}
+        if op == "fill":
+            text = request.get("text")
+            target = request.get("target")
+            if not isinstance(text, str):
+                raise ControlError("fill 需要字符串类型的 text")
+            if target is not None and not isinstance(target, str):
+                raise ControlError("target 必须是字符串")
+            return self.engine.ipc_fill(text, target)
+        if op == "status":
+            result = self.engine.ipc_status()
+            result["ipc"] = {"clients": self.clients, "requests": self.requests, "errors": self.errors}
+            return result
+        if op == "toggle":
+            enabled = request.get("enabled")
+            if enabled is not None and not isinstance(enabled, bool):
+                raise ControlError("enabled 必须是布尔值")
+            return self.engine.ipc_toggle(enabled)
+        if op == "reload":
+            return self.engine.ipc_reload()
+        raise ControlError(f"未知操作: {op}，支持: {', '.join(OPERATIONS)}")
+
+
+class ControlClient:
+    """控制通道客户端，供脚本使用
+
+    未指定 token 时从令牌文件读取，连接后自动完成认证。
+
+    示例:
+        with ControlClient() as client:
+            client.request("fill", text="你好", target="chrome")
+    """
+
+    def __init__(self, address: Optional[str] = None, token: Optional[str] = None,
+                 token_file: Optional[str] = None, timeout: Optional[float] = 5.0):
+        if token is None:
+            token = read_token(token_file)
+
+        family, sockaddr = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self._reader = None
+        self._next_id = 0
+
+        try:
+            self.sock.settimeout(timeout)
+            self.sock.connect(sockaddr)
+            if family == socket.AF_INET:
+                self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._reader = self.sock.makefile("rb")
+            self.request("auth", token=token)
+        except Exception:
+            self.close()
+            raise
+
+    def send(self, op: str, **params) -> int:
+        """发送一条请求但不等待响应，返回请求 id"""
+        return self.send_many([dict(params, op=op)])[0]
+
+    def send_many(self, requests) -> list:
+        """一次性发送多条请求（流水线），返回各请求的 id"""
+        ids = []
+        payload = bytearray()
+        for request in requests:
+            self._next_id += 1
+            ids.append(self._next_id)
+            payload += encode_message(dict(request, id=self._next_id))
+        self.sock.sendall(payload)
+        return ids
+
+    def receive(self) -> dict:
+        """读取下一条响应"""
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("控制通道已关闭")
+        return json.loads(line.decode("utf-8"))
+
+    def request(self, op: str, **params) -> dict:
+        """发送请求并返回结果，失败时抛出 ControlError"""
+        self.send(op, **params)
+        response = self.receive()
+        if not response.get("ok"):
+            raise ControlError(response.get("error"))
+        return response.get("result")
+
+    def close(self):
+        """关闭连接"""
+        if self._reader:
+            self._reader.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
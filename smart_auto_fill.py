@@ -8,6 +8,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import threading
+import queue
 import time
 import json
 import os
@@ -30,6 +31,11 @@ except ImportError as e:
     print("请运行: pip install pywin32 pynput pystray Pillow")
     exit(1)
 
+from fill_ipc import ControlServer, FillQueue
+
+# 控制通道运行中无法修改的配置，重新加载后需要停止并重新启动工具才能生效
+IPC_RESTART_KEYS = ("enabled", "address", "token_file")
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -63,6 +69,16 @@ class SmartAutoFillGUI:
         self.mouse_monitor_thread = None
         self.stop_monitoring = False
         
+        # 填充队列（控制通道提交的填充请求）
+        self.fill_worker_thread = None
+        self.fill_lock = threading.Lock()
+        
+        # 本地控制通道
+        self.control_server = None
+        self.control_server_config = {}
+        # 控制通道线程不直接操作界面，界面相关操作放入队列由主线程执行
+        self.ui_actions = queue.Queue()
+        
         # 当前鼠标位置和状态
         self.current_mouse_x = 0
         self.current_mouse_y = 0
@@ -77,9 +93,11 @@ class SmartAutoFillGUI:
         # 配置
         self.config_file = "smart_config.json"
         self.load_config()
+        self.fill_queue = FillQueue(self.get_ipc_config().get("queue_size", 1000))
         
         # 创建界面
         self.create_widgets()
+        self.root.after(50, self.process_ui_actions)
         
         # 设置pyautogui的安全设置
         pyautogui.FAILSAFE = True
@@ -112,6 +130,12 @@ class SmartAutoFillGUI:
                 "toggle": "ctrl+shift+a",
                 "status": "ctrl+shift+w",
                 "quit": "ctrl+shift+q"
+            },
+            "ipc": {
+                "enabled": False,
+                "address": "",
+                "token_file": "",
+                "queue_size": 1000
             }
         }
         
@@ -135,6 +159,10 @@ class SmartAutoFillGUI:
         self.max_content_length = self.config.get("max_content_length", 20000)
         self.mouse_check_interval = self.config.get("mouse_check_interval", 0.1)
     
+    def get_ipc_config(self) -> dict:
+        """获取控制通道配置"""
+        return self.config.get("ipc") or {}
+    
     def save_config(self):
         """保存配置"""
         try:
@@ -277,6 +305,29 @@ class SmartAutoFillGUI:
         status = "启用" if self.is_enabled else "禁用"
         self.log_message(f"智能填充功能已{status}")
     
+    def set_enabled(self, enabled: bool):
+        """设置启用状态"""
+        self.enabled_var.set(enabled)
+        self.toggle_enabled()
+    
+    def reload_config(self):
+        """重新加载配置文件并同步到界面"""
+        self.load_config()
+        self.enabled_var.set(self.is_enabled)
+        self.cooldown_var.set(self.fill_cooldown)
+        self.interval_var.set(self.mouse_check_interval)
+        self.length_var.set(self.max_content_length)
+        
+        ipc_config = self.get_ipc_config()
+        self.fill_queue.resize(ipc_config.get("queue_size", 1000))
+        self.log_message("配置已重新加载")
+        
+        if self.is_running:
+            changed = [f"ipc.{key}" for key in IPC_RESTART_KEYS
+                       if ipc_config.get(key) != self.control_server_config.get(key)]
+            if changed:
+                self.log_message(f"以下配置需要停止并重新启动工具后生效: {', '.join(changed)}")
+    
     def save_settings(self):
         """保存设置"""
         self.fill_cooldown = self.cooldown_var.get()
@@ -560,28 +611,32 @@ class SmartAutoFillGUI:
                 if current_content and current_content != last_content:
                     self.log_message(f"检测到剪贴板变化: {current_content[:50]}{'...' if len(current_content) > 50 else ''}")
                     
-                    # 检查是否可以自动填充
-                    if (self.is_enabled and 
-                        self.is_mouse_over_input and 
-                        current_content != self.last_clipboard):
-                        
-                        current_time = time.time()
-                        if current_time - self.last_fill_time >= self.fill_cooldown:
-                            self.last_fill_time = current_time
-                            self.last_clipboard = current_content
-                            
-                            # 延迟一小段时间确保剪贴板稳定
-                            time.sleep(0.1)
+                    # 检查是否可以自动填充（与填充队列互斥，避免重复填充脚本写入的内容）
+                    with self.fill_lock:
+                        if (self.is_enabled and 
+                            self.is_mouse_over_input and 
+                            current_content != self.last_clipboard):
                             
-                            # 执行自动填充
-                            self.fill_input_field(current_content)
+                            current_time = time.time()
+                            if self.get_clipboard_content() != current_content:
+                                # 等待锁期间填充队列可能已写入并粘贴了其他内容
+                                self.log_message("剪贴板已被脚本填充修改，跳过自动填充")
+                            elif current_time - self.last_fill_time >= self.fill_cooldown:
+                                self.last_fill_time = current_time
+                                self.last_clipboard = current_content
+                                
+                                # 延迟一小段时间确保剪贴板稳定
+                                time.sleep(0.1)
+                                
+                                # 执行自动填充
+                                self.fill_input_field(current_content)
+                            else:
+                                self.log_message("填充冷却中，跳过")
                         else:
-                            self.log_message("填充冷却中，跳过")
-                    else:
-                        if not self.is_mouse_over_input:
-                            self.log_message("鼠标不在输入框上，跳过自动填充")
-                        elif current_content == self.last_clipboard:
-                            self.log_message("内容与上次相同，跳过自动填充")
+                            if not self.is_mouse_over_input:
+                                self.log_message("鼠标不在输入框上，跳过自动填充")
+                            elif current_content == self.last_clipboard:
+                                self.log_message("内容与上次相同，跳过自动填充")
                 
                 last_content = current_content
                 time.sleep(0.1)  # 剪贴板检查间隔
@@ -590,6 +645,148 @@ class SmartAutoFillGUI:
                 self.log_message(f"剪贴板监控错误: {e}")
                 time.sleep(1)
     
+    def fill_worker(self):
+        """填充队列处理线程"""
+        while not self.stop_monitoring:
+            try:
+                seq, content, target = self.fill_queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            
+            try:
+                self.process_fill_request(seq, content, target)
+            except Exception as e:
+                self.fill_queue.count("failed")
+                self.log_message(f"填充请求 #{seq} 失败: {e}")
+    
+    def process_fill_request(self, seq: int, content: str, target: Optional[str]):
+        """执行一条填充请求"""
+        if not self.is_enabled:
+            self.fill_queue.count("skipped")
+            self.log_message(f"智能填充已禁用，跳过填充请求 #{seq}")
+            return
+        
+        with self.fill_lock:
+            skip_reason = self.get_fill_skip_reason(target)
+            if not skip_reason:
+                # 先记录内容，剪贴板监控线程会把这次复制视为已填充内容
+                # 填充后剪贴板保留为填充内容，不恢复原内容（目标程序异步读取剪贴板，恢复可能粘贴错内容）
+                previous_clipboard = pyperclip.paste()
+                self.last_clipboard = content
+                self.last_fill_time = time.time()
+                pyperclip.copy(content)
+                
+                # 延迟一小段时间确保剪贴板稳定
+                time.sleep(0.1)
+                
+                # 粘贴前再检查一次，防止等待期间鼠标移到了其他窗口
+                skip_reason = self.get_fill_skip_reason(target)
+                if not skip_reason:
+                    pyautogui.hotkey('ctrl', 'v')
+                else:
+                    # 没有粘贴，恢复用户原来的剪贴板，并让监控线程把恢复视为已处理内容
+                    pyperclip.copy(previous_clipboard)
+                    self.last_clipboard = self.get_clipboard_content() or ""
+        
+        if skip_reason:
+            self.fill_queue.count("skipped")
+            self.log_message(f"{skip_reason}，跳过填充请求 #{seq}")
+            return
+        
+        self.fill_queue.count("filled")
+        self.log_message(f"填充请求 #{seq} 完成: {content[:50]}{'...' if len(content) > 50 else ''}")
+    
+    def get_fill_skip_reason(self, target: Optional[str]) -> Optional[str]:
+        """检查鼠标位置是否可以执行填充请求，不能填充时返回原因"""
+        # 读取实时鼠标位置，鼠标监控线程的状态可能滞后一个检测间隔
+        x, y = pyautogui.position()
+        if not self.is_input_field(x, y):
+            return "鼠标不在输入框上"
+        
+        # 指定目标时，只在顶层窗口标题包含目标的窗口中填充
+        # WindowFromPoint 返回的是子控件，输入框的窗口文本是其内容而不是标题
+        if target:
+            hwnd = win32gui.WindowFromPoint((x, y))
+            window_title = win32gui.GetWindowText(win32gui.GetAncestor(hwnd, win32con.GA_ROOT)) if hwnd else ""
+            if target.lower() not in window_title.lower():
+                return f"当前窗口不匹配目标 {target}"
+        
+        return None
+    
+    def ipc_fill(self, text: str, target: Optional[str] = None) -> dict:
+        """控制通道: 提交填充请求到填充队列"""
+        return self.fill_queue.submit(text, target, self.is_enabled, self.max_content_length)
+    
+    def ipc_status(self) -> dict:
+        """控制通道: 查询状态和统计"""
+        return {
+            "running": self.is_running,
+            "enabled": self.is_enabled,
+            "mouse_over_input": self.is_mouse_over_input,
+            "mouse": [self.current_mouse_x, self.current_mouse_y],
+            "queue_depth": self.fill_queue.qsize(),
+            "metrics": self.fill_queue.snapshot()
+        }
+    
+    def process_ui_actions(self):
+        """在主线程中执行控制通道提交的界面操作"""
+        while True:
+            try:
+                action, args = self.ui_actions.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                action(*args)
+            except Exception as e:
+                self.log_message(f"执行控制请求失败: {e}")
+        
+        self.root.after(50, self.process_ui_actions)
+    
+    def ipc_toggle(self, enabled: Optional[bool] = None) -> dict:
+        """控制通道: 切换启用状态，未指定时取反"""
+        if enabled is None:
+            enabled = not self.is_enabled
+        
+        # 立即生效，界面同步和保存配置交给主线程
+        self.is_enabled = enabled
+        self.ui_actions.put((self.set_enabled, (enabled,)))
+        return {"enabled": enabled}
+    
+    def ipc_reload(self) -> dict:
+        """控制通道: 重新加载配置，由主线程异步执行"""
+        self.ui_actions.put((self.reload_config, ()))
+        return {
+            "scheduled": True,
+            "restart_required": [f"ipc.{key}" for key in IPC_RESTART_KEYS]
+        }
+    
+    def start_control_server(self):
+        """启动本地控制通道"""
+        ipc_config = self.get_ipc_config()
+        self.control_server_config = {key: ipc_config.get(key) for key in IPC_RESTART_KEYS}
+        if not ipc_config.get("enabled", False):
+            return
+        
+        try:
+            self.control_server = ControlServer(
+                self,
+                ipc_config.get("address") or None,
+                token_file=ipc_config.get("token_file") or None
+            )
+            self.control_server.start()
+            self.log_message(f"控制通道已启动: {self.control_server.address}")
+        except Exception as e:
+            self.control_server = None
+            self.log_message(f"启动控制通道失败: {e}")
+    
+    def stop_control_server(self):
+        """停止本地控制通道并丢弃未处理的填充请求"""
+        if self.control_server:
+            self.control_server.stop()
+            self.control_server = None
+        
+        self.fill_queue.clear()
+    
     def start_tool(self):
         """启动工具"""
         if self.is_running:
@@ -611,8 +808,13 @@ class SmartAutoFillGUI:
         self.mouse_monitor_thread = threading.Thread(target=self.mouse_monitor, daemon=True)
         self.clipboard_monitor_thread = threading.Thread(target=self.clipboard_monitor, daemon=True)
         
+        self.fill_worker_thread = threading.Thread(target=self.fill_worker, daemon=True)
+        
         self.mouse_monitor_thread.start()
         self.clipboard_monitor_thread.start()
+        self.fill_worker_thread.start()
+        
+        self.start_control_server()
         
         self.log_message("智能自动填充工具已启动")
         self.log_message("现在复制文本到剪贴板，鼠标悬停在输入框上即可自动填充")
@@ -629,6 +831,8 @@ class SmartAutoFillGUI:
         self.stop_button.config(state=tk.DISABLED)
         self.mouse_status_label.config(text="鼠标: 未知", foreground="gray")
         
+        self.stop_control_server()
+        
         self.log_message("智能自动填充工具已停止")
     
     def run(self):
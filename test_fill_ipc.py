@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+控制通道协议测试
+"""
+
+import gc
+import json
+import os
+import queue
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import time
+import unittest
+import warnings
+
+from fill_ipc import (
+    ControlClient, ControlError, ControlServer, FillQueue, QUEUE_FULL_ERROR, encode_message, parse_address
+)
+
+
+class StubEngine:
+    """记录调用的 engine，text 为 "control-error" / "internal-error" 时抛出对应异常
+
+    设置 release 后 ipc_reload 会阻塞到 release 被置位，用于模拟处理中的请求。
+    """
+
+    def __init__(self):
+        self.fills = []
+        self.enabled = True
+        self.reloading = threading.Event()
+        self.release = None
+
+    def ipc_fill(self, text, target=None):
+        if text == "control-error":
+            raise ControlError("填充被拒绝")
+        if text == "internal-error":
+            raise RuntimeError("boom")
+        self.fills.append((text, target))
+        return {"seq": len(self.fills)}
+
+    def ipc_status(self):
+        return {"enabled": self.enabled}
+
+    def ipc_toggle(self, enabled=None):
+        self.enabled = not self.enabled if enabled is None else enabled
+        return {"enabled": self.enabled}
+
+    def ipc_reload(self):
+        self.reloading.set()
+        if self.release:
+            self.release.wait(5)
+        return {}
+
+
+class ControlServerTests:
+    """Unix 域套接字和回环 TCP 共用的协议测试，子类通过 listen_address 指定地址"""
+
+    def listen_address(self) -> str:
+        raise NotImplementedError
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.token_file = os.path.join(self.workdir, "control.token")
+        self.engine = StubEngine()
+        self.server = ControlServer(
+            self.engine, self.listen_address(), token_file=self.token_file, max_request_size=4096
+        )
+        self.server.start()
+        self.address = self.server.address
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.workdir)
+
+    def raw_connect(self, authenticate=True) -> socket.socket:
+        """建立原始连接，可选完成认证"""
+        family, sockaddr = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect(sockaddr)
+        if authenticate:
+            sock.sendall(encode_message({"id": 0, "op": "auth", "token": self.server.token}))
+            self.assertTrue(self.read_responses(sock, 1)[0]["ok"])
+        return sock
+
+    def read_responses(self, sock: socket.socket, count: int) -> list:
+        """读取 count 条响应"""
+        data = b""
+        while data.count(b"\n") < count:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        return [json.loads(line) for line in data.splitlines()]
+
+    def assert_closed(self, sock: socket.socket):
+        """断言服务端已关闭连接"""
+        self.assertEqual(sock.recv(65536), b"")
+
+    def test_pipelined_responses_keep_request_order(self):
+        with ControlClient(self.address, token_file=self.token_file) as client:
+            ops = ["fill", "status", "ping", "toggle", "fill", "status"] * 20
+            requests = [{"op": op, "text": f"文本{i}"} if op == "fill" else {"op": op} for i, op in enumerate(ops)]
+            ids = client.send_many(requests)
+            responses = [client.receive() for _ in ids]
+
+        self.assertEqual([response["id"] for response in responses], ids)
+        self.assertTrue(all(response["ok"] for response in responses))
+        self.assertEqual([text for text, _ in self.engine.fills], [r["text"] for r in requests if r["op"] == "fill"])
+
+    def test_partial_lines_across_recv_calls(self):
+        sock = self.raw_connect()
+        payload = encode_message({"id": 1, "op": "fill", "text": "中文内容", "target": "chrome"})
+        # 在多字节字符中间拆开发送
+        split = payload.index("文".encode("utf-8")) + 1
+        sock.sendall(payload[:split])
+        time.sleep(0.1)
+        sock.sendall(payload[split:] + encode_message({"id": 2, "op": "ping"})[:5])
+        time.sleep(0.1)
+        sock.sendall(encode_message({"id": 2, "op": "ping"})[5:])
+
+        responses = self.read_responses(sock, 2)
+        sock.close()
+        self.assertEqual([response["id"] for response in responses], [1, 2])
+        self.assertEqual(self.engine.fills, [("中文内容", "chrome")])
+
+    def test_invalid_json_closes_connection(self):
+        sock = self.raw_connect()
+        sock.sendall(b"not json\n" + encode_message({"id": 1, "op": "ping"}))
+
+        responses = self.read_responses(sock, 2)
+        self.assertEqual(len(responses), 1)
+        self.assertFalse(responses[0]["ok"])
+        self.assert_closed(sock)
+        sock.close()
+
+    def test_non_object_line_closes_connection(self):
+        sock = self.raw_connect()
+        sock.sendall(b"[1, 2]\n" + encode_message({"id": 1, "op": "fill", "text": "x"}))
+
+        responses = self.read_responses(sock, 2)
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(responses[0]["error"], "请求必须是 JSON 对象")
+        self.assert_closed(sock)
+        sock.close()
+        self.assertEqual(self.engine.fills, [])
+
+    def test_http_request_cannot_smuggle_commands(self):
+        sock = self.raw_connect(authenticate=False)
+        body = json.dumps({"op": "fill", "text": "网页注入"})
+        sock.sendall(f"POST / HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: {len(body)}\r\n\r\n{body}\n".encode())
+
+        self.read_responses(sock, 1)
+        self.assert_closed(sock)
+        sock.close()
+        self.assertEqual(self.engine.fills, [])
+
+    def test_requests_require_authentication(self):
+        sock = self.raw_connect(authenticate=False)
+        sock.sendall(encode_message({"id": 1, "op": "toggle", "enabled": False}))
+
+        self.assertEqual(self.read_responses(sock, 1)[0]["error"], "认证失败")
+        self.assert_closed(sock)
+        sock.close()
+        self.assertTrue(self.engine.enabled)
+
+        with self.assertRaises(ControlError):
+            ControlClient(self.address, token="wrong")
+
+    def test_over_length_request_disconnects(self):
+        sock = self.raw_connect()
+        sock.sendall(b"x" * 5000)
+
+        responses = self.read_responses(sock, 1)
+        self.assertEqual(responses[0]["error"], "请求过长")
+        self.assert_closed(sock)
+        sock.close()
+
+    def test_control_error_and_internal_error_responses(self):
+        with ControlClient(self.address, token_file=self.token_file) as client:
+            ids = client.send_many([
+                {"op": "fill", "text": "control-error"},
+                {"op": "fill", "text": "internal-error"},
+                {"op": "nope"},
+                {"op": "ping"},
+            ])
+            responses = [client.receive() for _ in ids]
+
+        self.assertEqual(responses[0]["error"], "填充被拒绝")
+        self.assertEqual(responses[1]["error"], "内部错误")
+        self.assertTrue(responses[2]["error"].startswith("未知操作"))
+        # 请求层面的错误不断开连接
+        self.assertTrue(responses[3]["ok"])
+
+    def test_token_file_is_private_and_removed_on_stop(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.token_file).st_mode), 0o600)
+        self.server.stop()
+        self.assertFalse(os.path.exists(self.token_file))
+
+    def test_stop_does_not_tear_down_busy_thread(self):
+        self.engine.release = threading.Event()
+        client = ControlClient(self.address, token_file=self.token_file)
+        client.send("reload")
+        self.assertTrue(self.engine.reloading.wait(5))
+
+        started = time.monotonic()
+        self.server.stop(timeout=0.1)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertTrue(self.server._thread.is_alive())
+        with self.assertRaises(RuntimeError):
+            self.server.start()
+
+        # 当前请求处理完成后响应照常返回，随后服务线程自行清理
+        self.engine.release.set()
+        self.assertTrue(client.receive()["ok"])
+        self.server._thread.join(5)
+        self.assertFalse(self.server._thread.is_alive())
+        self.assertFalse(os.path.exists(self.token_file))
+        client.close()
+
+    def test_start_on_live_address_raises(self):
+        second = ControlServer(StubEngine(), self.address, token_file=os.path.join(self.workdir, "second.token"))
+        with self.assertRaises(OSError):
+            second.start()
+        with ControlClient(self.address, token_file=self.token_file) as client:
+            self.assertEqual(client.request("ping"), {})
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "需要 Unix 域套接字")
+class UnixControlServerTest(ControlServerTests, unittest.TestCase):
+    def listen_address(self) -> str:
+        return os.path.join(self.workdir, "control.sock")
+
+    def test_stop_removes_own_socket_file(self):
+        self.server.stop()
+        self.assertFalse(os.path.exists(self.address))
+
+    def test_stop_keeps_replaced_socket_file(self):
+        os.unlink(self.address)
+        other = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        other.bind(self.address)
+        try:
+            self.server.stop()
+            self.assertTrue(stat.S_ISSOCK(os.lstat(self.address).st_mode))
+        finally:
+            other.close()
+
+    def test_start_replaces_stale_socket(self):
+        self.server.stop()
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.address)
+        stale.close()
+
+        self.server.start()
+        with ControlClient(self.address, token_file=self.token_file) as client:
+            self.assertEqual(client.request("ping"), {})
+
+    def test_start_keeps_regular_file(self):
+        self.server.stop()
+        with open(self.address, "w", encoding="utf-8") as f:
+            f.write("keep")
+
+        with self.assertRaises(FileExistsError):
+            self.server.start()
+        with open(self.address, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), "keep")
+
+
+class TcpControlServerTest(ControlServerTests, unittest.TestCase):
+    def listen_address(self) -> str:
+        return "127.0.0.1:0"
+
+    def test_address_reports_bound_port(self):
+        host, port = self.address.rsplit(":", 1)
+        self.assertEqual(host, "127.0.0.1")
+        self.assertNotEqual(int(port), 0)
+        self.assertEqual(parse_address(self.address), (socket.AF_INET, ("127.0.0.1", int(port))))
+
+    def test_accepted_connections_disable_nagle(self):
+        with ControlClient(self.address, token_file=self.token_file) as client:
+            self.assertEqual(client.request("ping"), {})
+            connections = [key.data for key in self.server._selector.get_map().values() if key.data]
+            self.assertEqual(len(connections), 1)
+            self.assertTrue(connections[0].sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))
+
+    def test_second_start_keeps_first_token(self):
+        token = self.server.token
+        second = ControlServer(StubEngine(), self.address, token_file=self.token_file)
+        with self.assertRaises(OSError):
+            second.start()
+
+        with open(self.token_file, "r", encoding="utf-8") as f:
+            self.assertEqual(f.read(), token)
+        with ControlClient(self.address, token_file=self.token_file) as client:
+            self.assertEqual(client.request("ping"), {})
+
+
+class ControlClientTest(unittest.TestCase):
+    def test_failed_connect_closes_socket(self):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            with self.assertRaises(OSError):
+                ControlClient(f"127.0.0.1:{port}", token="token")
+            gc.collect()
+
+        self.assertFalse([w for w in caught if issubclass(w.category, ResourceWarning)])
+
+
+class ParseAddressTest(unittest.TestCase):
+    def test_host_port_is_tcp(self):
+        self.assertEqual(parse_address("127.0.0.1:47321"), (socket.AF_INET, ("127.0.0.1", 47321)))
+        self.assertEqual(parse_address("localhost:0"), (socket.AF_INET, ("localhost", 0)))
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "需要 Unix 域套接字")
+    def test_other_addresses_are_unix_paths(self):
+        self.assertEqual(parse_address("/tmp/control.sock"), (socket.AF_UNIX, "/tmp/control.sock"))
+        self.assertEqual(parse_address("C:\\fill.sock"), (socket.AF_UNIX, "C:\\fill.sock"))
+        self.assertEqual(parse_address(":47321"), (socket.AF_UNIX, ":47321"))
+
+
+class FillQueueTest(unittest.TestCase):
+    def test_submit_normalizes_and_queues(self):
+        fill_queue = FillQueue(10)
+        result = fill_queue.submit("  你好世界  ", "chrome", True, 2)
+
+        self.assertEqual(result, {"seq": 1, "queue_depth": 1})
+        self.assertEqual(fill_queue.get(timeout=0), (1, "你好", "chrome"))
+        self.assertEqual(fill_queue.snapshot()["submitted"], 1)
+
+    def test_rejects_when_disabled_or_empty(self):
+        fill_queue = FillQueue(10)
+        with self.assertRaises(ControlError):
+            fill_queue.submit("内容", None, False, 100)
+        with self.assertRaises(ControlError):
+            fill_queue.submit("   ", None, True, 100)
+
+        self.assertEqual(fill_queue.qsize(), 0)
+        self.assertEqual(fill_queue.snapshot()["rejected"], 2)
+
+    def test_rejects_when_full(self):
+        fill_queue = FillQueue(2)
+        fill_queue.submit("a", None, True, 100)
+        fill_queue.submit("b", None, True, 100)
+        with self.assertRaises(ControlError) as ctx:
+            fill_queue.submit("c", None, True, 100)
+
+        self.assertEqual(str(ctx.exception), QUEUE_FULL_ERROR)
+        metrics = fill_queue.snapshot()
+        self.assertEqual((metrics["submitted"], metrics["rejected"]), (2, 1))
+
+    def test_resize_and_clear(self):
+        fill_queue = FillQueue(1)
+        fill_queue.submit("a", None, True, 100)
+        fill_queue.resize(2)
+        fill_queue.submit("b", None, True, 100)
+        self.assertEqual((fill_queue.maxsize, fill_queue.qsize()), (2, 2))
+
+        fill_queue.clear()
+        self.assertEqual(fill_queue.qsize(), 0)
+        with self.assertRaises(queue.Empty):
+            fill_queue.get(timeout=0)
+
+    def test_count_worker_metrics(self):
+        fill_queue = FillQueue()
+        for name in ("filled", "filled", "skipped", "failed"):
+            fill_queue.count(name)
+
+        self.assertEqual(fill_queue.snapshot(), {"submitted": 0, "filled": 2, "skipped": 1, "failed": 1, "rejected": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()